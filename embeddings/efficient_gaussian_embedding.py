@@ -1,9 +1,271 @@
 from typing import List, Tuple, Dict
+from collections import defaultdict
+from math import log
 import numpy as np
-from itertools import permutations
 
 from tensor_network.tensor_network import TensorNetwork
-from tensor_network.tensor_network import Node, Edge
+from tensor_network.tensor_network import Node
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional, without it the search kernels run as regular python
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+
+@njit(cache=True, nogil=True)
+def _reachable_subset(edge_ends: np.ndarray, subset: int) -> int:
+    """
+    Finds the nodes of the subset that U reaches through edges between U and the nodes of the subset
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param subset: A bit mask of the nodes indices
+    :return: A bit mask of the reached nodes, equal to subset if the subset is connected to U
+    """
+    reached = np.int64(0)
+    grown = True
+    while grown:
+        grown = False
+        for e in range(edge_ends.shape[0]):
+            end1, end2 = edge_ends[e, 0], edge_ends[e, 1]
+            end1_in_U = end1 == -1 or (end1 >= 0 and (reached >> end1) & 1)
+            end2_in_U = end2 == -1 or (end2 >= 0 and (reached >> end2) & 1)
+            if end1_in_U and not end2_in_U and end2 >= 0 and (subset >> end2) & 1:
+                reached |= np.int64(1) << end2
+                grown = True
+            elif end2_in_U and not end1_in_U and end1 >= 0 and (subset >> end1) & 1:
+                reached |= np.int64(1) << end1
+                grown = True
+    return reached
+
+
+@njit(cache=True, nogil=True)
+def _is_adjacent(edge_ends: np.ndarray, contracted: np.ndarray, k: int) -> bool:
+    """
+    Checks if a node shares an edge with U
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param contracted: A boolean array of the nodes that were contracted into U
+    :param k: The index of the node
+    :return: True if U and the node share an edge
+    """
+    for e in range(edge_ends.shape[0]):
+        end1, end2 = edge_ends[e, 0], edge_ends[e, 1]
+        if end1 == k and (end2 == -1 or (end2 >= 0 and contracted[end2])):
+            return True
+        if end2 == k and (end1 == -1 or (end1 >= 0 and contracted[end1])):
+            return True
+    return False
+
+
+@njit(cache=True, nogil=True)
+def _subset_contraction_order(edge_ends: np.ndarray, subset: int, nodes_amount: int) -> np.ndarray:
+    """
+    Orders the nodes so the nodes of the subset are contracted first, and every node shares an edge with U when
+    it's contracted. At every step the first node by index that U shares an edge with is contracted, so the order
+    keeps the order of the contraction path where it can
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param subset: A bit mask of the nodes indices to contract first
+    :param nodes_amount: The amount of nodes to contract with U
+    :return: The contraction order as indices of the nodes
+    """
+    contracted = np.zeros(nodes_amount, dtype=np.bool_)
+    order = np.empty(nodes_amount, dtype=np.int64)
+    subset_remaining = 0
+    for k in range(nodes_amount):
+        subset_remaining += (subset >> k) & 1
+
+    for step in range(nodes_amount):
+        chosen = -1
+        first_candidate = -1
+        for k in range(nodes_amount):
+            if contracted[k] or (subset_remaining > 0 and not (subset >> k) & 1):
+                continue
+            if first_candidate == -1:
+                first_candidate = k
+            if _is_adjacent(edge_ends, contracted, k):
+                chosen = k
+                break
+        if chosen == -1:  # No candidate shares an edge with U, kept in index order
+            chosen = first_candidate
+
+        contracted[chosen] = True
+        order[step] = chosen
+        subset_remaining -= (subset >> chosen) & 1
+    return order
+
+
+@njit(parallel=True, cache=True, nogil=True)
+def _min_U_subset(edge_ends: np.ndarray, edge_dims: np.ndarray, nodes_amount: int) -> Tuple[int, float]:
+    """
+    Finds the subset of nodes that U should be contracted with to reach its minimal size.
+    An edge is left on U after contracting a subset if exactly one of its ends is in U or in the subset.
+    Only subsets that are connected to U can be contracted into it, the others are skipped.
+    The subsets are independent of each other and are evaluated in parallel chunks
+    :param edge_ends: The ends of every edge, -1 for U, -2 for no node or a node outside the search,
+                      otherwise the index of the node
+    :param edge_dims: The dimension of every edge
+    :param nodes_amount: The amount of nodes to contract with U
+    :return: The minimal subset as a bit mask of the nodes indices and the size of U after contracting it
+    """
+    # Every chunk of subsets keeps its own minimum, the chunks minimums are compared at the end
+    subsets_amount = 1 << nodes_amount
+    chunks_amount = min(subsets_amount, 64)
+    chunk_min_subsets = np.empty(chunks_amount, dtype=np.int64)
+    chunk_min_sizes = np.empty(chunks_amount)
+    for chunk in prange(chunks_amount):
+        chunk_min_size = np.inf
+        chunk_min_subset = -1
+        for subset in range(chunk * subsets_amount // chunks_amount, (chunk + 1) * subsets_amount // chunks_amount):
+            if _reachable_subset(edge_ends, subset) != subset:
+                continue
+            U_size = 1.0
+            for e in range(edge_ends.shape[0]):
+                ends_in_U = 0
+                for end in edge_ends[e]:
+                    if end == -1 or (end >= 0 and (subset >> end) & 1):
+                        ends_in_U += 1
+                if ends_in_U == 1:
+                    U_size *= edge_dims[e]
+            if U_size < chunk_min_size:
+                chunk_min_size = U_size
+                chunk_min_subset = subset
+        chunk_min_subsets[chunk] = chunk_min_subset
+        chunk_min_sizes[chunk] = chunk_min_size
+
+    min_chunk = 0
+    for chunk in range(1, chunks_amount):
+        if chunk_min_sizes[chunk] < chunk_min_sizes[min_chunk]:
+            min_chunk = chunk
+    return chunk_min_subsets[min_chunk], chunk_min_sizes[min_chunk]
+
+
+@njit(cache=True, nogil=True)
+def _U_size(edge_ends: np.ndarray, edge_dims: np.ndarray, contracted: np.ndarray) -> Tuple[float, float]:
+    """
+    Calculates the size of U after contracting the given nodes into it
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param edge_dims: The dimension of every edge
+    :param contracted: A boolean array of the nodes that were contracted into U
+    :return: The size of U and a lower bound on the size U can reach by contracting more nodes, the product of
+             the edges of U that none of the remaining nodes can contract
+    """
+    U_size = 1.0
+    lower_bound = 1.0
+    for e in range(edge_ends.shape[0]):
+        ends_in_U = 0
+        remaining_ends = 0
+        for end in edge_ends[e]:
+            if end == -1 or (end >= 0 and contracted[end]):
+                ends_in_U += 1
+            elif end >= 0:
+                remaining_ends += 1
+        if ends_in_U == 1:
+            U_size *= edge_dims[e]
+            if remaining_ends == 0:
+                lower_bound *= edge_dims[e]
+    return U_size, lower_bound
+
+
+@njit(cache=True, nogil=True)
+def _greedy_order(edge_ends: np.ndarray, edge_dims: np.ndarray, nodes_amount: int) -> Tuple[np.ndarray, int]:
+    """
+    Contracts into U at every step the node that shares an edge with U and results in the smallest U
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param edge_dims: The dimension of every edge
+    :param nodes_amount: The amount of nodes to contract with U
+    :return: The contraction order as indices of the nodes and the index in the order after which U is minimal,
+             -1 if U is minimal before any contraction
+    """
+    contracted = np.zeros(nodes_amount, dtype=np.bool_)
+    order = np.empty(nodes_amount, dtype=np.int64)
+    min_U_size, _ = _U_size(edge_ends, edge_dims, contracted)
+    sketch_index = -1
+
+    for step in range(nodes_amount):
+        chosen = -1
+        chosen_size = np.inf
+        # Only nodes that share an edge with U can be contracted into it, unless there are none
+        for attempt in range(2):
+            for k in range(nodes_amount):
+                if contracted[k] or (attempt == 0 and not _is_adjacent(edge_ends, contracted, k)):
+                    continue
+                contracted[k] = True
+                U_size, _ = _U_size(edge_ends, edge_dims, contracted)
+                contracted[k] = False
+                if U_size < chosen_size:
+                    chosen = k
+                    chosen_size = U_size
+            if chosen != -1:
+                break
+
+        contracted[chosen] = True
+        order[step] = chosen
+        if chosen_size < min_U_size:
+            min_U_size = chosen_size
+            sketch_index = step
+
+    return order, sketch_index
+
+
+@njit(cache=True, nogil=True)
+def _branch_and_bound_min_subset(edge_ends: np.ndarray, edge_dims: np.ndarray, nodes_amount: int,
+                                 initial_subset: int, max_subsets: int) -> int:
+    """
+    Depth first search over the subsets of nodes contracted into U for the one where U reaches its minimal size.
+    A subset is only extended with nodes that share an edge with U, so every visited subset is connected to U.
+    A subset isn't expanded when the edges of U that none of the remaining nodes can contract are already at least
+    as big as the minimal size found
+    :param edge_ends: The ends of every edge, as in _min_U_subset
+    :param edge_dims: The dimension of every edge
+    :param nodes_amount: The amount of nodes to contract with U, at most 63 so a subset fits in an int64 bit mask
+    :param initial_subset: A bit mask of a known subset to start the search from, e.g. the greedy one
+    :param max_subsets: The search stops with the best subset found so far after visiting this amount of subsets
+    :return: The minimal subset found as a bit mask of the nodes indices
+    """
+    contracted = np.zeros(nodes_amount, dtype=np.bool_)
+    for k in range(nodes_amount):
+        contracted[k] = (initial_subset >> k) & 1
+    min_subset = np.int64(initial_subset)
+    min_U_size, _ = _U_size(edge_ends, edge_dims, contracted)
+
+    contracted[:] = False
+    visited = {np.int64(0)}
+    stack = [(np.int64(0), _U_size(edge_ends, edge_dims, contracted)[0])]
+    child_subsets = np.empty(nodes_amount, dtype=np.int64)
+    child_sizes = np.empty(nodes_amount)
+    while len(stack) > 0 and len(visited) <= max_subsets:
+        subset, U_size = stack.pop()
+        if U_size < min_U_size:
+            min_U_size = U_size
+            min_subset = subset
+
+        for k in range(nodes_amount):
+            contracted[k] = (subset >> k) & 1
+        _, lower_bound = _U_size(edge_ends, edge_dims, contracted)
+        if lower_bound >= min_U_size:
+            continue
+
+        children_amount = 0
+        for k in range(nodes_amount):
+            child = subset | (np.int64(1) << k)
+            if child in visited or not _is_adjacent(edge_ends, contracted, k):
+                continue
+            visited.add(child)
+            contracted[k] = True
+            child_subsets[children_amount] = child
+            child_sizes[children_amount] = _U_size(edge_ends, edge_dims, contracted)[0]
+            children_amount += 1
+            contracted[k] = False
+
+        # The smallest child is pushed last so it's expanded first
+        for c in np.argsort(-child_sizes[:children_amount], kind="mergesort"):
+            stack.append((child_subsets[c], child_sizes[c]))
+
+    return min_subset
+
 
 class EfficientGaussianEmb:
     """
@@ -11,7 +273,18 @@ class EfficientGaussianEmb:
     Implements the paper: https://arxiv.org/abs/2205.13163
     """
 
-    def __init__(self, eps: float, delta: float, m_scalar: float, is_tn_embedding=False):
+    # Above this amount of contractions in D(e_i) the contraction order is chosen greedily.
+    # The exhaustive search goes over 2^k subsets, compiled and parallel with numba it handles a lot more of them
+    EXHAUSTIVE_SEARCH_MAX_CONTRACTIONS = 16 if NUMBA_AVAILABLE else 4
+
+    # The branch and bound search stops with the best order found so far after visiting this amount of subsets
+    BRANCH_AND_BOUND_MAX_SUBSETS = 1 << 12
+
+    # The branch and bound search holds the subsets as int64 bit masks, above this the greedy order is used
+    BRANCH_AND_BOUND_MAX_CONTRACTIONS = 63
+
+    def __init__(self, eps: float, delta: float, m_scalar: float, is_tn_embedding=False,
+                 sketch_method=TensorNetwork.GAUSSIAN, dtype=np.float32, contraction_plans=None):
         """
         Creats the Efficient Gaussian Embedding object.
         The embedding is eps-delta accurate
@@ -20,18 +293,40 @@ class EfficientGaussianEmb:
         :param m_scalar: The scalar to multiply m by in order to actually get good results.
         m=theta(N_E/log(1/delta)/eps^2) so we have m up to this scalar
         :param is_tn_embedding: Should we use TN or tree embedding
+        :param sketch_method: The sketch used for the dangling edges, one of TensorNetwork.GAUSSIAN,
+        TensorNetwork.SRHT or TensorNetwork.COUNT_SKETCH. With count sketches the contractions in S are sketched
+        with a tensor sketch instead of the tree embedding, so it can't be used with the TN embedding
+        :param dtype: The dtype of the gaussian sketching tensors. The embedding is only eps accurate, so float32
+        loses nothing and halves the memory of drawing and storing the sketching tensors
+        :param contraction_plans: A dict of contraction plans to share with other embeddings, e.g. the embeddings of
+        a sweep over m_scalar. The plans don't depend on the embedding parameters and the contraction paths are kept
+        for every m. Defaults to plans of this embedding only
         """
+        if is_tn_embedding and sketch_method == TensorNetwork.COUNT_SKETCH:
+            raise ValueError("The TN embedding can't be used with count sketches, their contractions in S are "
+                             "sketched with a tensor sketch")
+
         self.eps = eps
         self.delta = delta
         self.m_scalar = m_scalar
         self.is_tn_embedding = is_tn_embedding
+        self.sketch_method = sketch_method
+        self.dtype = dtype
+
+        # Constant parts of m, calculated once for all the embeddings
+        self._log_inv_delta = log(1 / delta)
+        self._eps_squared = eps ** 2
+
+        # The contraction plans are shared between embeddings of networks with the same structure and contraction
+        # path, <plan key : (D, S, I_S, paths)>. They are freed with the last embedding that shares them
+        self._contraction_plans = {} if contraction_plans is None else contraction_plans
 
     def calc_m(self, x: TensorNetwork):
         """
         We calculate the dimension size to sketch with
         :return: The dimensions size to sketch to
         """
-        m_theta = len(x.get_edges_to_sketch()) * np.log(1 / self.delta) / self.eps ** 2
+        m_theta = len(x.get_edges_to_sketch()) * self._log_inv_delta / self._eps_squared
         m = int(m_theta * self.m_scalar)
         return max(m, 1)
 
@@ -43,14 +338,31 @@ class EfficientGaussianEmb:
         :param contraction_path: The contraction path of x, T_0
         :return: An embedded tensor network
         """
-        edges_to_be_sketched = x.get_edges_to_sketch()
         m = self.calc_m(x)
 
-        D, S, I_S = self._partition_contractions(x, contraction_path, edges_to_be_sketched)
-        self._contract_and_sketch_kronecker_product(x, D, m)
+        D, S, I_S, paths = self._get_contraction_plan(x, contraction_path)
+        self._contract_and_sketch_kronecker_product(x, D, m, paths.setdefault(m, {}))
         self._contract_and_sketch_tree_embedding(S, I_S, x, m)
         return x
 
+    def _get_contraction_plan(self, x: TensorNetwork, contraction_path: List[Tuple[int, int]]):
+        """
+        Returns the partition of the contractions of x. The partition is calculated once for every network structure
+        and contraction path, and reused by the following embeddings that share the plans of networks with the same
+        structure
+        :param x: The tensor network to sketch
+        :param contraction_path: The contraction path for the tensor network
+        :return: D, S, I_S - The partition of the contractions as returned by _partition_contractions
+                 paths - The minimal contraction paths of D(e_i) calculated so far, one entry for every m used with
+                 the plan. Dict of the format <m : <i : Contraction path>>
+        """
+        plan_key = (x.get_structure(), tuple(tuple(contraction) for contraction in contraction_path))
+        if plan_key not in self._contraction_plans:
+            D, S, I_S = self._partition_contractions(x, contraction_path, x.get_edges_to_sketch())
+            # The partition is frozen so embeddings can't change a plan that the following embeddings use
+            self._contraction_plans[plan_key] = (dict(D), frozenset(S), tuple(I_S), {})
+        return self._contraction_plans[plan_key]
+
     def _partition_contractions(self, x: TensorNetwork, contraction_path: List[Tuple[int, int]],
                                 edges_to_sketch):
         """
@@ -58,54 +370,67 @@ class EfficientGaussianEmb:
         :param x: The tensor network to sketch
         :param contraction_path: The contraction path for the tensor network
         :param edges_to_sketch: Edges in E_1
-        :return:  D - Dict of the format <i : List[Contractions]>. Where each tuple represents D(e_i)
-                  S - A list of contractions with both nodes having dimensions to be sketched
+        :return:  D - Dict of the format <i : List[Contractions]>. Where each tuple represents D(e_i) and i is the
+                      index of e_i in edges_to_sketch. Edges with an empty D(e_i) aren't in D
+                  S - A set of contractions with both nodes having dimensions to be sketched
                   I_S - A list of contractions with no nodes to be sketched union with S
         """
-        D = {e: [] for e in edges_to_sketch}
-        S = []
+        edges_indices = {e: i for i, e in enumerate(edges_to_sketch)}
+        D = defaultdict(list)
+        S = set()
         I_S = []
 
+        dangling = {}  # <node index : dangling edges>, a node takes part in many contractions
         for contraction in contraction_path:
-            u_i = x[contraction[0]]
-            v_i = x[contraction[1]]
+            for node_index in contraction:
+                if node_index not in dangling:
+                    dangling[node_index] = x[node_index].get_all_dangling()
 
-            u_i_dangling = u_i.get_all_dangling()
-            v_i_dangling = v_i.get_all_dangling()
+            u_i_dangling = dangling[contraction[0]]
+            v_i_dangling = dangling[contraction[1]]
 
             u_i_dims_to_sketch = len(u_i_dangling)
             v_i_dims_to_sketch = len(v_i_dangling)
 
             if u_i_dims_to_sketch and v_i_dims_to_sketch:
-                S.append(contraction)
+                S.add(tuple(contraction))
                 I_S.append(contraction)
             elif u_i_dims_to_sketch == 1:
-                D[u_i_dangling[0]].append(contraction)
+                D[edges_indices[u_i_dangling[0]]].append(contraction)
             elif v_i_dims_to_sketch == 1:
-                D[v_i_dangling[0]].append(contraction)
+                D[edges_indices[v_i_dangling[0]]].append(contraction)
             else:
                 I_S.append(contraction)
         return D, S, I_S
 
-    def _contract_and_sketch_kronecker_product(self, x: TensorNetwork, D: Dict[Edge, List[Tuple[int, int]]],
-                                               m: int) -> None:
+    def _contract_and_sketch_kronecker_product(self, x: TensorNetwork, D: Dict[int, List[Tuple[int, int]]],
+                                               m: int, paths: Dict[int, List[Tuple[int, int]]]) -> None:
         """
         Sketcghes the kroncker product part of the algorithm and contracts when necessary
         :param x: The tensor network to contract
-        :param D: A dict where each tuple represents D(e_i)
+        :param D: A dict where each tuple represents D(e_i), edges with an empty D(e_i) aren't in it
         :param m: sketch dimension size
+        :param paths: The minimal contraction paths of D(e_i) already calculated for m, new paths are added to it
         """
-        for e, D_e_i in D.items():
-            if len(D_e_i) == 0:
-                x.sketch(edge=e, m=m)
-            else:
+        edges_to_sketch = x.get_edges_to_sketch()
+
+        # Edges without contractions are sketched together. They are dangling on nodes that aren't contracted
+        # in this part so the order of sketching doesn't change the paths of the other edges
+        isolated_edges = [e for e_i, e in enumerate(edges_to_sketch) if e_i not in D]
+        if isolated_edges:
+            x.sketch_batch(edges=isolated_edges, m=m, method=self.sketch_method, dtype=self.dtype)
+
+        # D(e_i) that share a node decide by their order which U contracts it, so they keep the edges order
+        for e_i in sorted(D):
+            e = edges_to_sketch[e_i]
+            if e_i not in paths:
                 e_i_hat_node_index = x.get_node_index(e.node1)
-                minimal_contraction_path = self._calculate_contraction_path_shapes(x, D_e_i, e_i_hat_node_index)
-                for i, j in minimal_contraction_path:
-                    if j is None:
-                        x.sketch(edge=e, m=m)
-                    else:
-                        x.contract(i, j)
+                paths[e_i] = self._calculate_contraction_path_shapes(x, D[e_i], e_i_hat_node_index)
+            for i, j in paths[e_i]:
+                if j is None:
+                    x.sketch(edge=e, m=m, method=self.sketch_method, dtype=self.dtype)
+                else:
+                    x.contract(i, j)
 
     def _calculate_contraction_path_shapes(self, x: TensorNetwork, D_e_i: List[Tuple[int, int]], i: int):
         """
@@ -118,71 +443,113 @@ class EfficientGaussianEmb:
         """
         u = x[i]
 
-        j_nodes = [u if v == i else v for u, v in D_e_i]
+        # Contractions with the same node, or with a node that was already contracted into U, are searched once
+        distinct_nodes = {u: i}
+        for contraction in D_e_i:
+            j = contraction[1] if contraction[0] == i else contraction[0]
+            distinct_nodes.setdefault(x[j], j)
+        del distinct_nodes[u]
 
-        contractions_permutations = list(permutations(j_nodes))
-        u_possible_sizes = []
-        u_possible_sketching_index = []
-        for permutation in contractions_permutations:
-            contraction_nodes = [x[i] for i in permutation]
-            min_u_size, min_u_size_index = self._contraction_path_minimize_U(u, contraction_nodes)
-            u_possible_sizes.append(min_u_size)
-            u_possible_sketching_index.append(min_u_size_index)
+        j_nodes = list(distinct_nodes.values())
+        contraction_nodes = list(distinct_nodes)
 
-        chosen_path_index = np.argmin(u_possible_sizes)
-        sketch_index = u_possible_sketching_index[chosen_path_index]
-        chosen_path = list(contractions_permutations[chosen_path_index])
+        edge_ends, edge_dims = self._index_edges(u, contraction_nodes)
+        if len(contraction_nodes) <= self.EXHAUSTIVE_SEARCH_MAX_CONTRACTIONS:
+            order, sketch_index = self._exhaustive_contraction_order(edge_ends, edge_dims, len(contraction_nodes))
+        else:
+            order, sketch_index = self._branch_and_bound_contraction_order(edge_ends, edge_dims,
+                                                                           len(contraction_nodes))
+
+        chosen_path = [j_nodes[k] for k in order]
         chosen_path.insert(sketch_index + 1, None)
         return list(zip([i] * len(chosen_path), chosen_path))
 
     @staticmethod
-    def _contraction_path_minimize_U(U: Node, contraction_order: List[Node]):
+    def _exhaustive_contraction_order(edge_ends: np.ndarray, edge_dims: np.ndarray,
+                                      nodes_amount: int) -> Tuple[List[int], int]:
         """
-        Calculates with a given contraction path, what is the minimal size U gets here and where
-        :param U: The node to minimize
-        :param contraction_order: List of nodes to contract with U in the specified order
-        :return: Minimum size of U reached during contractions and the index where this occurs
+        Finds the contraction order of nodes into U where U reaches its minimal size.
+        The size of U only depends on which nodes were contracted into it and not on their order, so the
+        compiled _min_U_subset goes over the subsets of nodes that are connected to U
+        :param edge_ends: The ends of every edge, as returned by _index_edges
+        :param edge_dims: The dimension of every edge
+        :param nodes_amount: The amount of nodes to contract with U
+        :return: The contraction order as indices of nodes and the index in the order after which to sketch U
         """
-        min_U_size = U.tensor.size
-        min_index = -1
-        current_shape = U.tensor.shape
+        min_subset, _ = _min_U_subset(edge_ends, edge_dims, nodes_amount)
+        return EfficientGaussianEmb._subset_order(edge_ends, int(min_subset), nodes_amount)
 
-        U_edges = {edge: current_shape[i] for i, edge in enumerate(U.edges)}
-
-        for i, V in enumerate(contraction_order):
-            contracted_indices = []
-            for edge in U.edges:
-                if edge in V.edges:
-                    contracted_indices.append(U_edges[edge])
+    @staticmethod
+    def _subset_order(edge_ends: np.ndarray, subset: int, nodes_amount: int) -> Tuple[List[int], int]:
+        """
+        Orders the contractions so the nodes of the subset are contracted first, every node when it shares an edge
+        with U
+        :param edge_ends: The ends of every edge, as returned by _index_edges
+        :param subset: A bit mask of the nodes indices to contract before sketching, connected to U
+        :param nodes_amount: The amount of nodes to contract with U
+        :return: The contraction order as indices of nodes and the index in the order after which to sketch U
+        """
+        order = _subset_contraction_order(edge_ends, subset, nodes_amount).tolist()
+        sketch_index = bin(subset).count("1") - 1
+        return order, sketch_index
 
-            new_shape = [dim for dim in current_shape if dim not in contracted_indices]
-            new_shape += [dim for dim in V.tensor.shape if dim not in contracted_indices]
+    @staticmethod
+    def _index_edges(U: Node, nodes: List[Node]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Indexes the edges of U and of the nodes into integer arrays
+        :param U: The node to minimize
+        :param nodes: The nodes to contract with U
+        :return: edge_ends - An int32 array of shape (edges, 2) with the ends of every edge. -1 for U, -2 for no node
+                             or a node outside of nodes, otherwise the index of the node in nodes
+                 edge_dims - An int64 array with the dimension of every edge
+        """
+        nodes_indices = {V: k for k, V in enumerate(nodes)}
+        nodes_indices[U] = -1
 
+        edge_dims = {}
+        for node in [U] + nodes:
+            edge_dims.update(zip(node.edges, node.tensor.shape))
 
-            new_U_size = np.prod(new_shape)
-            current_shape = new_shape
-            if new_U_size < min_U_size:
-                min_U_size = new_U_size
-                min_index = i
+        edge_ends = [[nodes_indices.get(end, -2) for end in (edge.node1, edge.node2)] for edge in edge_dims]
+        return (np.array(edge_ends, dtype=np.int32).reshape(-1, 2),
+                np.array(list(edge_dims.values()), dtype=np.int64))
 
-        return min_U_size, min_index
+    def _branch_and_bound_contraction_order(self, edge_ends: np.ndarray, edge_dims: np.ndarray,
+                                            nodes_amount: int) -> Tuple[List[int], int]:
+        """
+        Finds the contraction order of nodes into U where U reaches its minimal size, for more nodes than the
+        exhaustive search handles. The compiled search starts from the subset reached by the greedy order
+        :param edge_ends: The ends of every edge, as returned by _index_edges
+        :param edge_dims: The dimension of every edge
+        :param nodes_amount: The amount of nodes to contract with U
+        :return: The contraction order as indices of nodes and the index in the order after which to sketch U
+        """
+        greedy_order, greedy_sketch_index = _greedy_order(edge_ends, edge_dims, nodes_amount)
+        if nodes_amount > self.BRANCH_AND_BOUND_MAX_CONTRACTIONS:
+            return greedy_order.tolist(), int(greedy_sketch_index)
 
+        greedy_subset = sum(1 << int(k) for k in greedy_order[:greedy_sketch_index + 1])
+        min_subset = _branch_and_bound_min_subset(edge_ends, edge_dims, nodes_amount, greedy_subset,
+                                                  self.BRANCH_AND_BOUND_MAX_SUBSETS)
+        return self._subset_order(edge_ends, int(min_subset), nodes_amount)
 
     def _contract_and_sketch_tree_embedding(self, S, I_S, x, m) -> None:
         """
         Contracts and sketches the tree embedding part of the algorithm.
         i.e. contractions in S are sketched in a specific way with a tree like embedding and contractions in
         I are simply contracted
-        :param S: The contractions to be tree embedded
+        :param S: A set of the contractions to be tree embedded
         :param I_S: All contractions to make
         :param x: The tensornetwork
         :param m: The sketch dimension size
         """
         for i, j in I_S:
             if (i, j) in S:
-                if self.is_tn_embedding:
-                    x.tn_sketch_and_contract_s(i, j, m)
+                if self.sketch_method == TensorNetwork.COUNT_SKETCH:
+                    x.tensorsketch_and_contract(i, j, m)
+                elif self.is_tn_embedding:
+                    x.tn_sketch_and_contract_s(i, j, m, dtype=self.dtype)
                 else:
-                    x.tree_sketch_and_contract(i, j, m)
+                    x.tree_sketch_and_contract(i, j, m, dtype=self.dtype)
             else:
                 x.contract(i, j)
@@ -1,5 +1,7 @@
+from functools import partial
+from itertools import product
 from math import ceil
-from typing import List, Tuple
+from typing import List, Tuple, Dict
 
 import numpy as np
 import pandas as pd
@@ -8,14 +10,17 @@ from tensornetwork import Node
 
 from tensor_network.tensor_network import TensorNetwork
 from embeddings.efficient_gaussian_embedding import EfficientGaussianEmb
+from experiments.parallel import batch_map
 
 
 class KroneckerDataTester:
 
     KRONECKER_DATA_PATH = "results/kronecker_order_test/order_{order}_results.csv"
+    RESULTS_COLUMNS = ["order", "batch_num", "m_factor", "actual_m", "sketch_score_1", "sketch_score_2", "cost",
+                       "algo"]
 
     def __init__(self, order: List[int], m_scalar_options: List[int], kronecker_sketch_sizes: List[int],
-                 kronecker_factor: List[int], dim_size=1000, embed_eps=0.2, embed_delta=0.95):
+                 kronecker_factor: List[int], dim_size=1000, embed_eps=0.2, embed_delta=0.95, processes=None):
         """
         Builds the parameters of the experiments
         :param order: The order to tensors to check for
@@ -25,6 +30,8 @@ class KroneckerDataTester:
         :param embed_delta: The delta for the embedding
         :param kronecker_sketch_sizes: The sketch sizes to check for the katri rao embeddings
         :param kronecker_factor: We sub sketch with the kronecker structure with s_dim = m ** 1/n * kronecker_factors
+        :param processes: The amount of processes to run the experiments on, defaults to the amount of cpus.
+                          With 1 the experiments run sequentially
         """
         self.order = order
         self.m_scalar_options = m_scalar_options
@@ -33,6 +40,7 @@ class KroneckerDataTester:
         self.embed_delta = embed_delta
         self.kronecker_sketch_sizes = kronecker_sketch_sizes
         self.kronecker_factor = kronecker_factor
+        self.processes = processes
 
 
     def create_order_test_data(self, order) -> List[np.ndarray]:
@@ -120,28 +128,30 @@ class KroneckerDataTester:
         :param contraction_path: The contraction path
         :param kronecker_data: The data to run on
         """
-        for m_scalar in self.m_scalar_options:
-            for is_TN in [True, False]:
-                res["order"].append(order)
-                res["batch_num"].append(i)
-                res["m_factor"].append(m_scalar)
-                algo = EfficientGaussianEmb(eps=self.embed_delta, delta=self.embed_eps,
-                                            m_scalar=m_scalar, is_tn_embedding=is_TN)
-
-                # First sketching try
-                network, contraction_path = self.create_kronecker_network(kronecker_data, order)
-                chosen_m = algo.calc_m(network)
-                res["actual_m"].append(chosen_m)
-                tn = "TN" if is_TN else "Tree"
-                res["algo"].append(tn)
-                sketch_score = self._embed_and_eval_TN(kronecker_data, algo, network, contraction_path)
-                res["cost"].append(network.contractions_cost)
-                res["sketch_score_1"].append(sketch_score)
-
-                # Second Sketching Try
-                network, contraction_path = self.create_kronecker_network(kronecker_data, order)
-                sketch_score = self._embed_and_eval_TN(kronecker_data, algo, network, contraction_path)
-                res["sketch_score_2"].append(sketch_score)
+        # The embeddings of the sweep embed the same network structure, so they share its contraction plan
+        contraction_plans = {}
+        for m_scalar, is_TN in product(self.m_scalar_options, [True, False]):
+            res["order"].append(order)
+            res["batch_num"].append(i)
+            res["m_factor"].append(m_scalar)
+            algo = EfficientGaussianEmb(eps=self.embed_delta, delta=self.embed_eps,
+                                        m_scalar=m_scalar, is_tn_embedding=is_TN,
+                                        contraction_plans=contraction_plans)
+
+            # First sketching try
+            network, contraction_path = self.create_kronecker_network(kronecker_data, order)
+            chosen_m = algo.calc_m(network)
+            res["actual_m"].append(chosen_m)
+            tn = "TN" if is_TN else "Tree"
+            res["algo"].append(tn)
+            sketch_score = self._embed_and_eval_TN(kronecker_data, algo, network, contraction_path)
+            res["cost"].append(network.contractions_cost)
+            res["sketch_score_1"].append(sketch_score)
+
+            # Second Sketching Try
+            network, contraction_path = self.create_kronecker_network(kronecker_data, order)
+            sketch_score = self._embed_and_eval_TN(kronecker_data, algo, network, contraction_path)
+            res["sketch_score_2"].append(sketch_score)
 
     def run_katri_rao_on_kronecker(self, i, res, order, kronecker_data):
         """
@@ -151,50 +161,60 @@ class KroneckerDataTester:
         :param order: THe order of the tensors
         :param kronecker_data: The data representing kronecker data
         """
-        for m in self.kronecker_sketch_sizes:
-            for s_factor in self.kronecker_factor:
-                res["order"].append(order)
-                res["batch_num"].append(i)
-                res["m_factor"].append(1)
-                res["algo"].append("katri_rao")
+        for m, s_factor in product(self.kronecker_sketch_sizes, self.kronecker_factor):
+            res["order"].append(order)
+            res["batch_num"].append(i)
+            res["m_factor"].append(1)
+            res["algo"].append("katri_rao")
 
-                # First sketching try
-                sketch_score, contractions_cost, sketch_size = self._embed_and_eval_kronecker(kronecker_data,
-                                                                                             m,
-                                                                                             s_factor)
+            # First sketching try
+            sketch_score, contractions_cost, sketch_size = self._embed_and_eval_kronecker(kronecker_data,
+                                                                                         m,
+                                                                                         s_factor)
 
-                res["actual_m"].append(sketch_size)
-                res["cost"].append(contractions_cost)
-                res["sketch_score_1"].append(sketch_score)
+            res["actual_m"].append(sketch_size)
+            res["cost"].append(contractions_cost)
+            res["sketch_score_1"].append(sketch_score)
 
-                # Second Sketching Try
-                sketch_score, contractions_cost, sketch_size = self._embed_and_eval_kronecker(kronecker_data,
-                                                                                             m,
-                                                                                             s_factor)
+            # Second Sketching Try
+            sketch_score, contractions_cost, sketch_size = self._embed_and_eval_kronecker(kronecker_data,
+                                                                                         m,
+                                                                                         s_factor)
 
-                res["sketch_score_2"].append(sketch_score)
+            res["sketch_score_2"].append(sketch_score)
+
+    def run_batch(self, order, i) -> Dict[str, List]:
+        """
+        Runs all the embeddings on a single generated kronecker data. Used by the processes of the experiment
+        :param order: The order of the tensors
+        :param i: The index of run insied the order batch
+        :return: The results of the batch
+        """
+        res = {column: [] for column in self.RESULTS_COLUMNS}
+        kronecker_data = self.create_order_test_data(order)
+        self.run_katri_rao_on_kronecker(i, res, order, kronecker_data)
+        self.run_tree_and_TN_on_kronecker(i, res, order, kronecker_data)
+        return res
 
 
     def run_kronecker_order_test_and_save(self) -> None:
         """
         Runs the order test experiments and saves the results in a csv.
         Compares the execution for the TN and Tree embedding & katri-rao embeddings
-        Runs 25 experiments for each configuration
-        """
-        res = {"order": [], "batch_num": [],
-              "m_factor":[], "actual_m": [], "sketch_score_1": [],
-               "sketch_score_2": [], "cost": [], "algo": []}
-        for order in self.order:
-            print("Kronecker Data Experiment. Working on order:", order)
-            for i in range(25):
-                print(f"Kroncker Tensor generated: {i}/25")
-                kronecker_data = self.create_order_test_data(order)
-                self.run_katri_rao_on_kronecker(i, res, order, kronecker_data)
-                self.run_tree_and_TN_on_kronecker(i, res, order, kronecker_data)
-
-            path_to_save = self.KRONECKER_DATA_PATH.format(order=order)
-            print(f"Saved Kronecker results in {path_to_save}")
-            pd.DataFrame(res).to_csv(path_to_save)  # Note we save a checkpoint for every order
+        Runs 25 experiments for each configuration, the experiments are independent and run in parallel
+        """
+        res = {column: [] for column in self.RESULTS_COLUMNS}
+        with batch_map(self.processes) as map_batches:
+            for order in self.order:
+                print("Kronecker Data Experiment. Working on order:", order)
+                for i, batch_res in enumerate(map_batches(partial(self.run_batch, order), range(25))):
+                    print(f"Kroncker Tensor generated: {i + 1}/25")
+                    for column, values in batch_res.items():
+                        res[column] += values
+
+                path_to_save = self.KRONECKER_DATA_PATH.format(order=order)
+                print(f"Saved Kronecker results in {path_to_save}")
+                pd.DataFrame(res).to_csv(path_to_save)  # Note we save a checkpoint for every order
 
 
 if __name__ == "__main__":
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import numpy as np
+
+from embeddings.efficient_gaussian_embedding import NUMBA_AVAILABLE
+
+
+def init_worker() -> None:
+    """
+    Initializes a process of the experiments.
+    Reseeds so the processes don't generate the same data, and limits the BLAS and numba threads of the process
+    to one so the processes don't oversubscribe the cpus
+    """
+    np.random.seed()
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=1)
+    except ImportError:  # threadpoolctl is optional, without it BLAS keeps its threads
+        pass
+    if NUMBA_AVAILABLE:
+        from numba import set_num_threads
+        set_num_threads(1)
+
+
+@contextmanager
+def batch_map(processes=None):
+    """
+    Maps the experiment batches on processes
+    :param processes: The amount of processes to run the batches on, defaults to the amount of cpus.
+                      With 1 the batches run sequentially in the current process
+    :return: A map function over the batches, the results are returned in the order of the batches
+    """
+    if processes == 1:
+        yield map
+        return
+
+    with Pool(processes=processes, initializer=init_worker) as pool:
+        yield pool.imap
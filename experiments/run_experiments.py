@@ -13,11 +13,13 @@ def create_folders():
     os.makedirs("./results/kronecker_order_test", exist_ok=True)
     os.makedirs("./results/tt_rank_test", exist_ok=True)
 
-def main(order, ranks):
+def main(order, ranks, processes=None):
     """
     Runs the experiments, analyzes the data and creates the graphs.
     :param order: The orders for the TT experiment
     :param ranks: The ranks for the kronecker experiment
+    :param processes: The amount of processes to run the experiments on, defaults to the amount of cpus.
+                      With 1 the experiments run sequentially
     """
     # Create folders
     create_folders()
@@ -26,12 +28,12 @@ def main(order, ranks):
     m_scalar_options = [4, 5, 6, 7]
     kronecker_sketch_sizes = [1000, 3000, 5000, 10 ** 4, 15000, 20000]
     kroncker_data_tester = KroneckerDataTester(order=order, m_scalar_options=m_scalar_options, kronecker_factor=[1, 2],
-                                               kronecker_sketch_sizes=kronecker_sketch_sizes)
+                                               kronecker_sketch_sizes=kronecker_sketch_sizes, processes=processes)
     kroncker_data_tester.run_kronecker_order_test_and_save()
 
     # Run TT Experiments
     m_scalar_options = [3, 4, 5, 6, 7, 8]
-    tt_data_tester = TTDataTester(rank=ranks, m_scalar_options=m_scalar_options)
+    tt_data_tester = TTDataTester(rank=ranks, m_scalar_options=m_scalar_options, processes=processes)
     tt_data_tester.run_rank_test_and_save()
 
     # Create Graphs
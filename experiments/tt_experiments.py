@@ -1,4 +1,6 @@
-from typing import List, Tuple
+from functools import partial
+from itertools import product
+from typing import List, Tuple, Dict
 
 import numpy as np
 import pandas as pd
@@ -7,13 +9,16 @@ from tensornetwork import Node
 
 from tensor_network.tensor_network import TensorNetwork
 from embeddings.efficient_gaussian_embedding import EfficientGaussianEmb
+from experiments.parallel import batch_map
 
 
 class TTDataTester:
 
     TT_RANK_DATA_PATH = "results/tt_rank_test/rank_{rank}_results.csv"
+    RESULTS_COLUMNS = ["rank", "batch_num", "m_factor", "actual_m", "sketch_score_1", "sketch_score_2", "cost", "algo"]
 
-    def __init__(self, rank, m_scalar_options, tt_order=6, dim_size=500, embed_eps=0.2, embed_delta=0.9):
+    def __init__(self, rank, m_scalar_options, tt_order=6, dim_size=500, embed_eps=0.2, embed_delta=0.9,
+                 processes=None):
         """
         The parameters of the experiments
         :param rank: The rank of the TT blocks
@@ -22,6 +27,8 @@ class TTDataTester:
         :param dim_size: The dimension size for all dimensions
         :param embed_eps: The eps for the embedding
         :param embed_delta: The delta for the embedding
+        :param processes: The amount of processes to run the experiments on, defaults to the amount of cpus.
+                          With 1 the experiments run sequentially
         """
         self.rank = rank
         self.m_scalar_options = m_scalar_options
@@ -29,6 +36,7 @@ class TTDataTester:
         self.dim_size = dim_size
         self.embed_eps = embed_eps
         self.embed_delta = embed_delta
+        self.processes = processes
 
 
     def create_rank_test_data(self, rank) -> List[np.ndarray]:
@@ -91,47 +99,60 @@ class TTDataTester:
         :return:
         """
         tt_data = self.create_rank_test_data(rank)
-        for m_scalar in self.m_scalar_options:
-            for is_TN in [True, False]:
-                res["rank"].append(rank)
-                res["batch_num"].append(i)
-                res["m_factor"].append(m_scalar)
-                algo = EfficientGaussianEmb(eps=self.embed_delta, delta=self.embed_eps,
-                                            m_scalar=m_scalar, is_tn_embedding=is_TN)
-
-                # First sketching try
-                network, contraction_path = self.create_tt_network(tt_data)
-                chosen_m = algo.calc_m(network)
-                res["actual_m"].append(chosen_m)
-                tn = "TN" if is_TN else "Tree"
-                res["algo"].append(tn)
-                sketch_score = self._embed_and_eval(tt_data, algo, network, contraction_path)
-                res["cost"].append(network.contractions_cost)
-                res["sketch_score_1"].append(sketch_score)
-
-                # Second Sketching Try
-                network, contraction_path = self.create_tt_network(tt_data)
-                sketch_score = self._embed_and_eval(tt_data, algo, network, contraction_path)
-                res["sketch_score_2"].append(sketch_score)
+        # The embeddings of the sweep embed the same network structure, so they share its contraction plan
+        contraction_plans = {}
+        for m_scalar, is_TN in product(self.m_scalar_options, [True, False]):
+            res["rank"].append(rank)
+            res["batch_num"].append(i)
+            res["m_factor"].append(m_scalar)
+            algo = EfficientGaussianEmb(eps=self.embed_delta, delta=self.embed_eps,
+                                        m_scalar=m_scalar, is_tn_embedding=is_TN,
+                                        contraction_plans=contraction_plans)
+
+            # First sketching try
+            network, contraction_path = self.create_tt_network(tt_data)
+            chosen_m = algo.calc_m(network)
+            res["actual_m"].append(chosen_m)
+            tn = "TN" if is_TN else "Tree"
+            res["algo"].append(tn)
+            sketch_score = self._embed_and_eval(tt_data, algo, network, contraction_path)
+            res["cost"].append(network.contractions_cost)
+            res["sketch_score_1"].append(sketch_score)
+
+            # Second Sketching Try
+            network, contraction_path = self.create_tt_network(tt_data)
+            sketch_score = self._embed_and_eval(tt_data, algo, network, contraction_path)
+            res["sketch_score_2"].append(sketch_score)
+
+    def run_batch(self, rank, i) -> Dict[str, List]:
+        """
+        Runs all the configurations on a single generated TT. Used by the processes of the experiment
+        :param rank: The tt rank of the tensors
+        :param i: experiment index
+        :return: The results of the batch
+        """
+        res = {column: [] for column in self.RESULTS_COLUMNS}
+        self.run_single_configuration(i, res, rank)
+        return res
 
     def run_rank_test_and_save(self) -> None:
         """
         Runs the rank test experiments and saves the results in a csv.
         Compares the execution for the TN and Tree embedding.
-        Runs 25 experiments for each configuration
+        Runs 25 experiments for each configuration, the experiments are independent and run in parallel
         """
-        res = {"rank": [], "batch_num": [],
-              "m_factor":[], "actual_m": [], "sketch_score_1": [],
-               "sketch_score_2": [], "cost": [], "algo": []}
-        for rank in self.rank:
-            print("TT data experiment. Working on Rank:", rank)
-            for i in range(25):
-                print(f"TT Tensors generated: {i}/25")
-                self.run_single_configuration(i, res, rank)
-
-            path_to_save = self.TT_RANK_DATA_PATH.format(rank=rank)
-            print(f"Saved TT results in {path_to_save}")
-            pd.DataFrame(res).to_csv(path_to_save)  # Note we save a checkpoint for every rank
+        res = {column: [] for column in self.RESULTS_COLUMNS}
+        with batch_map(self.processes) as map_batches:
+            for rank in self.rank:
+                print("TT data experiment. Working on Rank:", rank)
+                for i, batch_res in enumerate(map_batches(partial(self.run_batch, rank), range(25))):
+                    print(f"TT Tensors generated: {i + 1}/25")
+                    for column, values in batch_res.items():
+                        res[column] += values
+
+                path_to_save = self.TT_RANK_DATA_PATH.format(rank=rank)
+                print(f"Saved TT results in {path_to_save}")
+                pd.DataFrame(res).to_csv(path_to_save)  # Note we save a checkpoint for every rank
 
 
 if __name__ == "__main__":
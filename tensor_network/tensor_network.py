@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Tuple
+from math import sqrt
 import numpy as np
 from tensornetwork import Node, Edge
 import tensornetwork as tn
@@ -6,6 +7,12 @@ import tensornetwork as tn
 
 class TensorNetwork:
 
+    # The sketches of the dangling edges
+    GAUSSIAN = "gaussian"
+    SRHT = "srht"
+    COUNT_SKETCH = "count_sketch"
+    SKETCH_METHODS = (GAUSSIAN, SRHT, COUNT_SKETCH)
+
     def __init__(self, v: List[Node], edge_list: List):
         """
         A tensor graph object
@@ -30,18 +37,79 @@ class TensorNetwork:
             nodes_copies.append(Node(node.tensor.copy(), name=node.name))
         self._original_tensor = nodes_copies
 
-    def sketch(self, edge: Edge, m: int) -> None:
+    def sketch(self, edge: Edge, m: int, method: str = GAUSSIAN, dtype=np.float64) -> None:
         """
         Sketches the node which dangles edge
         :param m: The dimension to sketch v[i]'s dangling dimensions
         :param edge: The edge of v[i] to sketch
+        :param method: The sketch to use. A dense gaussian matrix, a subsampled randomized hadamard transform or
+                       a count sketch. The last two are applied without creating the sketching matrix
+        :param dtype: The dtype of the gaussian sketching matrix
+        """
+        self._validate_sketch_method(method)
+        if method == self.SRHT:
+            self._apply_structured_sketch(edge, self._srht(edge.node1.tensor, edge.axis1, m))
+        elif method == self.COUNT_SKETCH:
+            self._apply_structured_sketch(edge, self._count_sketch(edge.node1.tensor, edge.axis1, m))
+        else:
+            sketching_matrix = self._gaussian((m, edge.dimension), m, dtype)
+            self._apply_sketch(edge, sketching_matrix)
+
+    def sketch_batch(self, edges: List[Edge], m: int, method: str = GAUSSIAN, dtype=np.float64) -> None:
+        """
+        Sketches the nodes which dangle the edges. The gaussian sketching matrices of all the edges are drawn at once
+        :param edges: The edges to sketch
+        :param m: The dimension to sketch the edges to
+        :param method: The sketch to use, see sketch
+        :param dtype: The dtype of the gaussian sketching matrices
+        """
+        self._validate_sketch_method(method)
+        if method != self.GAUSSIAN:
+            for edge in edges:
+                self.sketch(edge, m, method)
+            return
+
+        dims = [edge.dimension for edge in edges]
+        sketching_matrices = self._gaussian((m, sum(dims)), m, dtype)
+        for edge, sketching_matrix in zip(edges, np.split(sketching_matrices, np.cumsum(dims)[:-1], axis=1)):
+            self._apply_sketch(edge, sketching_matrix)
+
+    def _validate_sketch_method(self, method: str) -> None:
+        """
+        Checks that the sketch method is one of SKETCH_METHODS
+        :param method: The sketch method
+        """
+        if method not in self.SKETCH_METHODS:
+            raise ValueError(f"Unknown sketch method {method!r}, expected one of {self.SKETCH_METHODS}")
+
+    @staticmethod
+    def _gaussian(shape: Tuple[int, ...], m: int, dtype) -> np.ndarray:
+        """
+        Draws a gaussian sketching tensor normalized by the sketch size.
+        The tensor is drawn directly in dtype by a generator seeded from np.random, so np.random.seed still
+        reproduces it
+        :param shape: The shape of the tensor
+        :param m: The sketch size
+        :param dtype: The dtype of the tensor, np.float32 or np.float64
+        :return: The sketching tensor
+        """
+        generator = np.random.default_rng(np.random.randint(np.iinfo(np.int64).max, dtype=np.int64))
+        sketching_tensor = generator.standard_normal(shape, dtype=dtype)
+        sketching_tensor /= sqrt(m)
+        return sketching_tensor
+
+    def _apply_sketch(self, edge: Edge, sketching_matrix: np.ndarray) -> None:
+        """
+        Sketches the node which dangles edge with the given sketching matrix
+        :param edge: The edge to sketch
+        :param sketching_matrix: A matrix of shape (m, edge dimension)
         """
         assert edge.node2 is None, f"Tried to sketch {edge}, but it is connected to {edge.node2}"
         node = edge.node1
         sketched_node = node
         dim = edge.axis1
 
-        sketching_node = Node(np.random.randn(m, sketched_node.shape[dim]) / np.sqrt(m))
+        sketching_node = Node(sketching_matrix)
         sketch_edge = sketched_node[dim] ^ sketching_node[1]
         self._count_contraction_cost(sketching_node, node)
         sketched_node = tn.contract(sketch_edge)
@@ -52,6 +120,79 @@ class TensorNetwork:
             if self._v[i] == node:
                 self._v[i] = sketched_node
 
+    def _apply_structured_sketch(self, edge: Edge, sketched_tensor: np.ndarray) -> None:
+        """
+        Replaces the node which dangles edge with its sketched tensor. The other edges of the node are moved to the
+        new node, the sketched dimension stays in the same axis
+        :param edge: The edge that was sketched
+        :param sketched_tensor: The tensor of the node after sketching the axis of edge
+        """
+        assert edge.node2 is None, f"Tried to sketch {edge}, but it is connected to {edge.node2}"
+        node = edge.node1
+        sketched_node = Node(sketched_tensor, name=f"s_{node.name}")
+        for axis, node_edge in enumerate(node.edges):
+            if node_edge is not edge:
+                node_edge.update_axis(axis, node, axis, sketched_node)
+                sketched_node.add_edge(node_edge, axis, override=True)
+
+        for i in range(len(self._v)):
+            if self._v[i] == node:
+                self._v[i] = sketched_node
+
+    def _srht(self, tensor: np.ndarray, axis: int, m: int) -> np.ndarray:
+        """
+        Sketches an axis of the tensor with a subsampled randomized hadamard transform, S * H * D.
+        D flips random signs, H is a fast walsh hadamard transform over the axis padded to a power of 2
+        and S samples m of its rows
+        :param tensor: The tensor to sketch
+        :param axis: The axis to sketch
+        :param m: The dimension to sketch the axis to
+        :return: The sketched tensor
+        """
+        dim = tensor.shape[axis]
+        n = 1 << (dim - 1).bit_length()
+
+        signs = np.random.choice(np.array([-1, 1], dtype=np.int8), size=dim)
+        x = np.moveaxis(tensor, axis, 0).reshape(dim, -1)
+        columns = x.shape[1]
+        hadamard = np.zeros((n, columns), dtype=np.result_type(tensor.dtype, np.float32))
+        hadamard[:dim] = signs[:, None] * x
+
+        h = 1
+        while h < n:
+            hadamard = hadamard.reshape(n // (2 * h), 2, h, columns)
+            hadamard = np.concatenate((hadamard[:, 0] + hadamard[:, 1], hadamard[:, 0] - hadamard[:, 1]), axis=1)
+            h *= 2
+        hadamard = hadamard.reshape(n, columns)
+
+        rows = np.random.choice(n, size=m, replace=m > n)
+        sketched = hadamard[rows] / sqrt(m)  # A python float keeps the dtype of the tensor
+        self.contractions_cost += columns * n * max(np.log2(n), 1)
+
+        sketched = sketched.reshape((m,) + tuple(np.delete(tensor.shape, axis)))
+        return np.moveaxis(sketched, 0, axis)
+
+    def _count_sketch(self, tensor: np.ndarray, axis: int, m: int) -> np.ndarray:
+        """
+        Sketches an axis of the tensor with a count sketch. Every index of the axis is added with a random sign
+        to a random index of the sketched axis
+        :param tensor: The tensor to sketch
+        :param axis: The axis to sketch
+        :param m: The dimension to sketch the axis to
+        :return: The sketched tensor
+        """
+        dim = tensor.shape[axis]
+        buckets = np.random.randint(0, m, size=dim, dtype=np.int32)
+        signs = np.random.choice(np.array([-1, 1], dtype=np.int8), size=dim)
+
+        x = np.moveaxis(tensor, axis, 0).reshape(dim, -1)
+        sketched = np.zeros((m, x.shape[1]), dtype=np.result_type(tensor.dtype, np.float32))
+        np.add.at(sketched, buckets, signs[:, None] * x)
+        self.contractions_cost += tensor.size
+
+        sketched = sketched.reshape((m,) + tuple(np.delete(tensor.shape, axis)))
+        return np.moveaxis(sketched, 0, axis)
+
     def get_original_tensor(self) -> np.ndarray:
         """
         Gets the actual original tensor before embedding
@@ -129,6 +270,16 @@ class TensorNetwork:
         """
         return self._edges_to_sketch
 
+    def get_structure(self) -> Tuple:
+        """
+        Returns a hashable description of the structure of the network, i.e. the shapes of its nodes and how they
+        are connected. Networks with the same structure are contracted and sketched in the same way
+        :return: The shapes of the nodes and the edge list of the network
+        """
+        shapes = tuple(tuple(node.tensor.shape) for node in self._v)
+        edges = tuple((tuple(u_tuple), tuple(v_tuple)) for u_tuple, v_tuple in self._edge_list)
+        return shapes, edges
+
     def __getitem__(self, key) -> Node:
         """
         Returns the node at index key
@@ -157,12 +308,13 @@ class TensorNetwork:
         contraction_cost = U_size * V_size / np.prod(shared_dims)
         self.contractions_cost += contraction_cost
 
-    def tree_sketch_and_contract(self, i: int, j: int, m: int) -> None:
+    def tree_sketch_and_contract(self, i: int, j: int, m: int, dtype=np.float64) -> None:
         """
         In case we want to tree embed and not use the actuall paper algorithm.
         :param i: The index for the first node
         :param j: The index for the second node
         :param m: The dimension size to embed to
+        :param dtype: The dtype of the gaussian tree tensor
         """
         u_orig = self[i]
         v_orig = self[j]
@@ -173,7 +325,7 @@ class TensorNetwork:
         v_dangling = [e for e in v_orig.get_all_dangling() if e.dimension == m][0]
         u_dangling = [e for e in u_orig.get_all_dangling() if e.dimension == m][0]
 
-        new_node = Node(np.random.randn(m, m, m) / np.sqrt(m))
+        new_node = Node(self._gaussian((m, m, m), m, dtype))
         new_node[0] ^ u_orig[u_dangling.axis1]
         new_node[1] ^ v_orig[v_dangling.axis1]
         self.contract(i, j)
@@ -188,6 +340,59 @@ class TensorNetwork:
             if self._v[i] == u:
                 self._v[i] = new_node
 
+    def tensorsketch_and_contract(self, i: int, j: int, m: int) -> None:
+        """
+        Contracts two nodes of the S partition and sketches their two dangling dimensions of size m into one with a
+        tensor sketch, the count sketch of their kronecker product. Each dangling dimension is count sketched and
+        moved to the frequency domain, where the count sketch of the product is an element wise product. So the
+        product of the two dimensions is never created
+        :param i: The index of the first node
+        :param j: The index of the second node
+        :param m: The sketching size
+        """
+        u = self[i]
+        v = self[j]
+
+        cut_u_v_edges = [e for e in u.edges if e in v.edges]
+        assert len(cut_u_v_edges), "Experiments require only cases where there is a single edge between the two"
+
+        u_dangling = [e for e in u.get_all_dangling() if e.dimension == m][0]
+        v_dangling = [e for e in v.get_all_dangling() if e.dimension == m][0]
+
+        u_hat = np.fft.rfft(self._count_sketch(u.tensor, u_dangling.axis1, m), axis=u_dangling.axis1)
+        v_hat = np.fft.rfft(self._count_sketch(v.tensor, v_dangling.axis1, m), axis=v_dangling.axis1)
+
+        # Labels for einsum, the shared edges are contracted and the frequency dimension is element wise
+        labels = {edge: label for label, edge in enumerate(set(u.edges) | set(v.edges))}
+        frequency_label = labels[u_dangling]
+        labels[v_dangling] = frequency_label
+        u_labels = [labels[edge] for edge in u.edges]
+        v_labels = [labels[edge] for edge in v.edges]
+
+        u_remaining = [(axis, edge) for axis, edge in enumerate(u.edges)
+                       if edge not in cut_u_v_edges and edge is not u_dangling]
+        v_remaining = [(axis, edge) for axis, edge in enumerate(v.edges)
+                       if edge not in cut_u_v_edges and edge is not v_dangling]
+        remaining = [(u, axis, edge) for axis, edge in u_remaining] + [(v, axis, edge) for axis, edge in v_remaining]
+        out_labels = [labels[edge] for _, _, edge in remaining] + [frequency_label]
+
+        uv_hat = np.einsum(u_hat, u_labels, v_hat, v_labels, out_labels, optimize=True)
+        uv = np.fft.irfft(uv_hat, n=m, axis=-1).astype(np.result_type(u.tensor.dtype, v.tensor.dtype), copy=False)
+
+        cut_u_v = np.prod([e.dimension for e in cut_u_v_edges])
+        fft_cost = m * max(np.log2(m), 1)
+        self.contractions_cost += (u.tensor.size + v.tensor.size) / m * fft_cost
+        self.contractions_cost += uv.size / m * (m // 2 + 1) * cut_u_v + uv.size / m * fft_cost
+
+        new_node = Node(uv, name=f"ts_{u.name}_{v.name}")
+        for new_axis, (node, axis, edge) in enumerate(remaining):
+            edge.update_axis(axis, node, new_axis, new_node)
+            new_node.add_edge(edge, new_axis, override=True)
+
+        for k in range(len(self._v)):
+            if self._v[k] in [u, v]:
+                self._v[k] = new_node
+
     @staticmethod
     def _closest_dividers(m: int, split_dimension: float):
         """
@@ -208,7 +413,7 @@ class TensorNetwork:
                     min_diff = diff
         return closest_b1, closest_b2
 
-    def tn_sketch_and_contract_s(self, i: int, j: int, m: int) -> None:
+    def tn_sketch_and_contract_s(self, i: int, j: int, m: int, dtype=np.float64) -> None:
         """
         Takes two indices that describe nodes that should be contracted under the S partition and does the necessary
         embedding and contracting.
@@ -216,6 +421,7 @@ class TensorNetwork:
         :param i: The index of the first node
         :param j: The index of the second node
         :param m: The sketching size
+        :param dtype: The dtype of the gaussian z_i tree tensors
         """
         u_orig = self[i]
         v_orig = self[j]
@@ -247,8 +453,8 @@ class TensorNetwork:
         e_v1, e_v2 = tn.split_edge(v_dangling, [split_dim_1, split_dim_2])
 
         # Create z_i tree tensor
-        v_1 = Node(np.random.randn(m, split_dim_1, m) / np.sqrt(m))
-        v_2 = Node(np.random.randn(m, split_dim_2, m) / np.sqrt(m))
+        v_1 = Node(self._gaussian((m, split_dim_1, m), m, dtype))
+        v_2 = Node(self._gaussian((m, split_dim_2, m), m, dtype))
 
         # Connect the relevant edges
         v_1[1] ^ v[e_v1.axis1]
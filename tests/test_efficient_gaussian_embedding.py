@@ -0,0 +1,24 @@
+import numpy as np
+from tensornetwork import Node
+
+from tensor_network.tensor_network import TensorNetwork
+from embeddings.efficient_gaussian_embedding import EfficientGaussianEmb
+
+
+def test_contraction_order_only_contracts_nodes_connected_to_U():
+    """
+    The minimal subset of D(e_i) is {B, C}, but B only shares an edge with U after C is contracted into it
+    """
+    U = Node(np.random.rand(2, 2, 50))
+    X = Node(np.random.rand(2, 2, 100))
+    B = Node(np.random.rand(2, 50))
+    C = Node(np.random.rand(50, 50))
+    Y = Node(np.random.rand(100, 3))
+    # U-X, U-C, X-B, X-Y, B-C
+    edges = [[(0, 1), (1, 1)], [(0, 2), (3, 1)], [(1, 0), (2, 0)], [(1, 2), (4, 0)], [(2, 1), (3, 0)]]
+    network = TensorNetwork(v=[U, X, B, C, Y], edge_list=edges)
+
+    algo = EfficientGaussianEmb(eps=0.5, delta=0.5, m_scalar=1)
+    m = algo.calc_m(network)
+    embedded_network = algo.embed(network, [(0, 1), (0, 2), (0, 3), (0, 4)])
+    assert embedded_network[0].tensor.shape == (m,)